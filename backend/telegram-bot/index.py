@@ -5,17 +5,85 @@ import json
 import os
 import requests
 import psycopg2
-from typing import Dict, Any, Optional
+import psycopg2.pool
+from typing import Dict, Any, Optional, List
 
 TELEGRAM_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '')
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org')
+TELEGRAM_TIMEOUT = 10
 DATABASE_URL = os.environ.get('DATABASE_URL', '')
 
+# Общая HTTP-сессия: переиспользует соединения между запросами
+http_session = requests.Session()
+
+# Пул соединений с БД (включается через init_db_pool в долгоживущем процессе)
+db_pool: Optional[psycopg2.pool.ThreadedConnectionPool] = None
+
+# Маркер «состояние не загружено заранее»; None означает, что записи в БД нет
+STATE_NOT_LOADED: Any = object()
+
+def init_db_pool(minconn: int, maxconn: int):
+    """Создание пула соединений с базой данных"""
+    global db_pool
+    if db_pool is None:
+        db_pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, DATABASE_URL)
+
 def get_db_connection():
     """Подключение к базе данных"""
+    if db_pool is not None:
+        return db_pool.getconn()
     return psycopg2.connect(DATABASE_URL)
 
+def release_db_connection(conn, error: Optional[Exception] = None):
+    """Возврат соединения в пул или закрытие; после ошибки транзакция откатывается"""
+    broken = bool(conn.closed) or isinstance(error, psycopg2.OperationalError)
+    if error is not None and not broken:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            broken = True
+    if db_pool is not None:
+        # Сломанные соединения не возвращаем в пул, а закрываем
+        db_pool.putconn(conn, close=broken)
+    else:
+        conn.close()
+
+def row_to_state(row) -> Dict[str, Any]:
+    """Преобразование строки user_states в словарь состояния"""
+    return {
+        'step': row[0],
+        'preferences': row[1],
+        'menu': row[2]
+    }
+
+def get_user_states(chat_ids: List[int]) -> Dict[int, Optional[Dict[str, Any]]]:
+    """Получить состояния нескольких пользователей одним запросом"""
+    states: Dict[int, Optional[Dict[str, Any]]] = {chat_id: None for chat_id in chat_ids}
+    if not chat_ids:
+        return states
+    conn = get_db_connection()
+    error = None
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT chat_id, step, preferences, menu FROM user_states WHERE chat_id = ANY(%s)",
+            (list(chat_ids),)
+        )
+        for row in cur.fetchall():
+            states[row[0]] = row_to_state(row[1:])
+        cur.close()
+        conn.commit()
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        release_db_connection(conn, error)
+    return states
+
 def get_user_state(chat_id: int) -> Optional[Dict[str, Any]]:
     """Получить состояние пользователя из БД"""
+    conn = None
+    error = None
     try:
         conn = get_db_connection()
         cur = conn.cursor()
@@ -25,21 +93,23 @@ def get_user_state(chat_id: int) -> Optional[Dict[str, Any]]:
         )
         row = cur.fetchone()
         cur.close()
-        conn.close()
+        conn.commit()
         
         if row:
-            return {
-                'step': row[0],
-                'preferences': row[1],
-                'menu': row[2]
-            }
+            return row_to_state(row)
         return None
     except Exception as e:
+        error = e
         print(f"Error getting user state: {e}")
         return None
+    finally:
+        if conn is not None:
+            release_db_connection(conn, error)
 
 def save_user_state(chat_id: int, state: Dict[str, Any]):
     """Сохранить состояние пользователя в БД"""
+    conn = None
+    error = None
     try:
         conn = get_db_connection()
         cur = conn.cursor()
@@ -60,13 +130,16 @@ def save_user_state(chat_id: int, state: Dict[str, Any]):
         ))
         conn.commit()
         cur.close()
-        conn.close()
     except Exception as e:
+        error = e
         print(f"Error saving user state: {e}")
+    finally:
+        if conn is not None:
+            release_db_connection(conn, error)
 
 def send_message(chat_id: int, text: str, reply_markup: Optional[Dict] = None) -> Dict:
     """Отправка сообщения в Telegram"""
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
+    url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_TOKEN}/sendMessage"
     payload = {
         "chat_id": chat_id,
         "text": text,
@@ -75,7 +148,7 @@ def send_message(chat_id: int, text: str, reply_markup: Optional[Dict] = None) -
     if reply_markup:
         payload["reply_markup"] = reply_markup
     
-    response = requests.post(url, json=payload)
+    response = http_session.post(url, json=payload, timeout=TELEGRAM_TIMEOUT)
     return response.json()
 
 def translate_to_russian(text: str) -> str:
@@ -89,7 +162,7 @@ def translate_to_russian(text: str) -> str:
             'dt': 't',
             'q': text
         }
-        response = requests.get(url, params=params, timeout=5)
+        response = http_session.get(url, params=params, timeout=5)
         if response.status_code == 200:
             result = response.json()
             if result and len(result) > 0 and len(result[0]) > 0:
@@ -101,7 +174,7 @@ def translate_to_russian(text: str) -> str:
 def fetch_meals_by_category(category: str, limit: int = 30) -> list:
     """Получение рецептов по категории из TheMealDB"""
     try:
-        response = requests.get(
+        response = http_session.get(
             f'https://www.themealdb.com/api/json/v1/1/filter.php?c={category}',
             timeout=10
         )
@@ -111,7 +184,7 @@ def fetch_meals_by_category(category: str, limit: int = 30) -> list:
             # Получаем детали для каждого блюда
             detailed_meals = []
             for meal in meals[:limit]:
-                detail_response = requests.get(
+                detail_response = http_session.get(
                     f'https://www.themealdb.com/api/json/v1/1/lookup.php?i={meal["idMeal"]}',
                     timeout=5
                 )
@@ -136,7 +209,7 @@ def fetch_random_meals_from_db(count: int = 21) -> list:
     meals = []
     try:
         for _ in range(count):
-            response = requests.get(
+            response = http_session.get(
                 'https://www.themealdb.com/api/json/v1/1/random.php',
                 timeout=10
             )
@@ -347,9 +420,10 @@ def handle_start(chat_id: int):
         keyboard
     )
 
-def handle_callback(chat_id: int, callback_data: str):
+def handle_callback(chat_id: int, callback_data: str, state: Optional[Dict[str, Any]] = STATE_NOT_LOADED):
     """Обработка нажатий на кнопки"""
-    state = get_user_state(chat_id)
+    if state is STATE_NOT_LOADED:
+        state = get_user_state(chat_id)
     if not state:
         handle_start(chat_id)
         return
@@ -495,47 +569,59 @@ def handle_callback(chat_id: int, callback_data: str):
         
         send_message(chat_id, shopping_message)
 
+def get_update_chat_id(update: Dict[str, Any]) -> Optional[int]:
+    """Определение chat_id, к которому относится update"""
+    if 'callback_query' in update:
+        message = update['callback_query'].get('message') or {}
+    else:
+        message = update.get('message') or {}
+    return (message.get('chat') or {}).get('id')
+
+def process_update(body: Dict[str, Any], state: Optional[Dict[str, Any]] = STATE_NOT_LOADED):
+    """Обработка одного update от Telegram; state — заранее загруженное состояние чата (None — записи нет)"""
+    chat_id = get_update_chat_id(body)
+    
+    # Обработка callback кнопок
+    if 'callback_query' in body:
+        callback = body['callback_query']
+        # У callback от inline-сообщений нет чата — только подтверждаем его
+        if chat_id is not None:
+            handle_callback(chat_id, callback.get('data', ''), state)
+        
+        # Подтверждаем получение callback
+        http_session.post(
+            f"{TELEGRAM_API_URL}/bot{TELEGRAM_TOKEN}/answerCallbackQuery",
+            json={"callback_query_id": callback['id']},
+            timeout=TELEGRAM_TIMEOUT
+        )
+    
+    # Обработка текстовых сообщений
+    elif chat_id is not None:
+        text = body['message'].get('text', '')
+        
+        if text == '/start':
+            handle_start(chat_id)
+        elif text == '/menu':
+            if state is STATE_NOT_LOADED:
+                state = get_user_state(chat_id)
+            if state and state.get('menu'):
+                menu_message = format_menu_message({'menu': state['menu']})
+                send_message(chat_id, menu_message)
+            else:
+                send_message(chat_id, "❌ Сначала создайте меню командой /start")
+        else:
+            send_message(
+                chat_id,
+                "Используйте команду /start для создания меню"
+            )
+
 def handler(event: dict, context) -> dict:
     """
     Основной обработчик webhook от Telegram
     """
     try:
         body = json.loads(event.get('body', '{}'))
-        
-        # Обработка callback кнопок
-        if 'callback_query' in body:
-            callback = body['callback_query']
-            chat_id = callback['message']['chat']['id']
-            callback_data = callback['data']
-            
-            handle_callback(chat_id, callback_data)
-            
-            # Подтверждаем получение callback
-            requests.post(
-                f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/answerCallbackQuery",
-                json={"callback_query_id": callback['id']}
-            )
-        
-        # Обработка текстовых сообщений
-        elif 'message' in body:
-            message = body['message']
-            chat_id = message['chat']['id']
-            text = message.get('text', '')
-            
-            if text == '/start':
-                handle_start(chat_id)
-            elif text == '/menu':
-                state = get_user_state(chat_id)
-                if state and state.get('menu'):
-                    menu_message = format_menu_message({'menu': state['menu']})
-                    send_message(chat_id, menu_message)
-                else:
-                    send_message(chat_id, "❌ Сначала создайте меню командой /start")
-            else:
-                send_message(
-                    chat_id,
-                    "Используйте команду /start для создания меню"
-                )
+        process_update(body)
         
         return {
             'statusCode': 200,
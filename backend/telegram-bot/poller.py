@@ -0,0 +1,175 @@
+"""
+Long-polling запуск бота: пачки update через getUpdates вместо webhook
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+
+from requests.adapters import HTTPAdapter
+
+import index
+
+POLL_TIMEOUT = int(os.environ.get('POLL_TIMEOUT', '30'))
+POLL_LIMIT = int(os.environ.get('POLL_LIMIT', '100'))
+POLL_WORKERS = int(os.environ.get('POLL_WORKERS', '8'))
+POLL_MAX_BACKLOG = int(os.environ.get('POLL_MAX_BACKLOG', str(POLL_LIMIT)))
+
+class ChatDispatcher:
+    """
+    Очереди update по чатам: update одного чата обрабатываются по очереди,
+    разные чаты — параллельно в пуле потоков. Новые update занятого чата
+    дописываются в его очередь и не задерживают остальные чаты.
+    Если все POLL_WORKERS потоков заняты долгими задачами (генерация меню),
+    остальные чаты ждут свободный поток. Число принятых, но ещё не обработанных
+    update ограничено: пока очередь полна, новые update остаются в Telegram.
+    """
+
+    def __init__(self, executor: ThreadPoolExecutor):
+        self.executor = executor
+        self.lock = threading.Condition()
+        self.queues: Dict[int, List[Dict[str, Any]]] = {}
+        self.pending = 0
+
+    def wait_for_capacity(self, max_backlog: int) -> int:
+        """Ожидание, пока необработанных update станет меньше max_backlog; возвращает свободное место"""
+        with self.lock:
+            self.lock.wait_for(lambda: self.pending < max_backlog)
+            return max_backlog - self.pending
+
+    def is_busy(self, chat_id: int) -> bool:
+        """Есть ли у чата необработанные или обрабатываемые update"""
+        with self.lock:
+            return chat_id in self.queues
+
+    def submit(self, chat_id: int, updates: List[Dict[str, Any]], state: Optional[Dict[str, Any]] = index.STATE_NOT_LOADED):
+        """Постановка update чата в очередь; state используется, только если чат свободен"""
+        with self.lock:
+            self.pending += len(updates)
+            if chat_id in self.queues:
+                self.queues[chat_id].extend(updates)
+                return
+            self.queues[chat_id] = list(updates)
+        self.executor.submit(self.drain, chat_id, state)
+
+    def drain(self, chat_id: int, state: Optional[Dict[str, Any]]):
+        """Последовательная обработка очереди чата, пока она не опустеет"""
+        while True:
+            with self.lock:
+                pending = self.queues[chat_id]
+                if not pending:
+                    del self.queues[chat_id]
+                    return
+                self.queues[chat_id] = []
+            for update in pending:
+                process_update_safely(update, state)
+                # Заранее загруженное состояние годится только для первого update
+                state = index.STATE_NOT_LOADED
+                with self.lock:
+                    self.pending -= 1
+                    self.lock.notify_all()
+
+def process_update_safely(update: Dict[str, Any], state: Optional[Dict[str, Any]] = index.STATE_NOT_LOADED):
+    """Обработка update с логированием ошибок"""
+    try:
+        index.process_update(update, state)
+    except Exception as e:
+        print(f"Error processing update {update.get('update_id')}: {e}")
+
+def delete_webhook():
+    """Снятие webhook: long-polling несовместим с активным webhook"""
+    response = index.http_session.post(
+        f"{index.TELEGRAM_API_URL}/bot{index.TELEGRAM_TOKEN}/deleteWebhook",
+        timeout=index.TELEGRAM_TIMEOUT
+    )
+    data = response.json()
+    if not data.get('ok'):
+        raise RuntimeError(data.get('description', 'deleteWebhook failed'))
+
+def get_updates(offset: int, limit: int = POLL_LIMIT) -> List[Dict[str, Any]]:
+    """Получение пачки update через getUpdates"""
+    response = index.http_session.post(
+        f"{index.TELEGRAM_API_URL}/bot{index.TELEGRAM_TOKEN}/getUpdates",
+        json={
+            "offset": offset,
+            "limit": limit,
+            "timeout": POLL_TIMEOUT,
+            "allowed_updates": ["message", "callback_query"]
+        },
+        timeout=POLL_TIMEOUT + index.TELEGRAM_TIMEOUT
+    )
+    data = response.json()
+    if not data.get('ok'):
+        raise RuntimeError(data.get('description', 'getUpdates failed'))
+    return data.get('result', [])
+
+def group_by_chat(updates: List[Dict[str, Any]]) -> Dict[int, List[Dict[str, Any]]]:
+    """Группировка update по chat_id с сохранением порядка внутри чата"""
+    groups: Dict[int, List[Dict[str, Any]]] = {}
+    for update in updates:
+        try:
+            chat_id = index.get_update_chat_id(update)
+        except Exception as e:
+            print(f"Skipping malformed update {update!r:.200}: {e}")
+            continue
+        if chat_id is not None:
+            groups.setdefault(chat_id, []).append(update)
+    return groups
+
+def next_offset(updates: List[Dict[str, Any]], offset: int) -> int:
+    """Offset для следующего getUpdates: сдвигаемся за все полученные update"""
+    update_ids = [
+        update.get('update_id') for update in updates
+        if isinstance(update, dict) and isinstance(update.get('update_id'), int)
+    ]
+    if not update_ids:
+        return offset
+    return max(max(update_ids) + 1, offset)
+
+def dispatch_batch(dispatcher: ChatDispatcher, updates: List[Dict[str, Any]]):
+    """Раздача пачки по чатам с загрузкой состояний свободных чатов одним запросом"""
+    groups = group_by_chat(updates)
+    idle_chat_ids = [chat_id for chat_id in groups if not dispatcher.is_busy(chat_id)]
+    try:
+        states = index.get_user_states(idle_chat_ids)
+    except Exception as e:
+        print(f"Error prefetching user states: {e}")
+        states = {}
+    for chat_id, chat_updates in groups.items():
+        dispatcher.submit(chat_id, chat_updates, states.get(chat_id, index.STATE_NOT_LOADED))
+
+def poll_once(dispatcher: ChatDispatcher, offset: int) -> int:
+    """Один цикл getUpdates; возвращает новый offset"""
+    # Не подтверждаем новые update, пока не обработаны уже принятые
+    capacity = dispatcher.wait_for_capacity(POLL_MAX_BACKLOG)
+    updates = get_updates(offset, min(POLL_LIMIT, capacity))
+    try:
+        dispatch_batch(dispatcher, updates)
+    except Exception as e:
+        print(f"Error dispatching updates: {e}")
+    # Offset сдвигается в любом случае, иначе сбойный update будет приходить снова
+    return next_offset(updates, offset)
+
+def run():
+    """Основной цикл long-polling"""
+    # Потокам пула нужно по соединению, ещё одно — для пакетной загрузки состояний
+    index.init_db_pool(1, POLL_WORKERS + 1)
+    adapter = HTTPAdapter(pool_connections=POLL_WORKERS, pool_maxsize=POLL_WORKERS + 1)
+    index.http_session.mount('http://', adapter)
+    index.http_session.mount('https://', adapter)
+
+    delete_webhook()
+
+    offset = 0
+    with ThreadPoolExecutor(max_workers=POLL_WORKERS) as executor:
+        dispatcher = ChatDispatcher(executor)
+        while True:
+            try:
+                offset = poll_once(dispatcher, offset)
+            except Exception as e:
+                print(f"Error getting updates: {e}")
+                time.sleep(1)
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,234 @@
+"""
+Тесты long-polling запуска с фейковым сервером Telegram
+"""
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import psycopg2
+import pytest
+
+import index
+import poller
+
+def message_update(update_id, chat_id, text='/start'):
+    return {'update_id': update_id, 'message': {'chat': {'id': chat_id}, 'text': text}}
+
+def callback_update(update_id, chat_id, data='regenerate'):
+    return {
+        'update_id': update_id,
+        'callback_query': {'id': str(update_id), 'data': data, 'message': {'chat': {'id': chat_id}}}
+    }
+
+@pytest.fixture
+def fake_telegram(monkeypatch):
+    """Локальный сервер Bot API: отдаёт заданные update и запоминает запросы"""
+    calls = []
+    responses = {'getUpdates': {'ok': True, 'result': []}, 'deleteWebhook': {'ok': True, 'result': True}}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            method = self.path.rsplit('/', 1)[-1]
+            length = int(self.headers.get('Content-Length') or 0)
+            calls.append((method, json.loads(self.rfile.read(length) or b'{}')))
+            body = json.dumps(responses.get(method, {'ok': True, 'result': {}})).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(index, 'TELEGRAM_API_URL', f'http://127.0.0.1:{server.server_port}')
+    monkeypatch.setattr(index, 'TELEGRAM_TOKEN', 'test')
+    yield calls, responses
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def processed(monkeypatch):
+    """Подменяет обработку update и загрузку состояний, записывая вызовы"""
+    calls = []
+    monkeypatch.setattr(index, 'process_update', lambda update, state=index.STATE_NOT_LOADED: calls.append((update['update_id'], state)))
+    monkeypatch.setattr(index, 'get_user_states', lambda chat_ids: {chat_id: {'chat': chat_id} for chat_id in chat_ids})
+    return calls
+
+def test_get_update_chat_id():
+    assert index.get_update_chat_id(message_update(1, 10)) == 10
+    assert index.get_update_chat_id(callback_update(2, 20)) == 20
+    assert index.get_update_chat_id({'update_id': 3, 'callback_query': {'id': 'x', 'inline_message_id': 'y'}}) is None
+    assert index.get_update_chat_id({'update_id': 4, 'message': {}}) is None
+    assert index.get_update_chat_id({'update_id': 5, 'edited_message': {'chat': {'id': 1}}}) is None
+
+def test_group_by_chat_keeps_order():
+    updates = [message_update(1, 10), callback_update(2, 20), message_update(3, 10), {'update_id': 4}, callback_update(5, 20)]
+    groups = poller.group_by_chat(updates)
+    assert list(groups) == [10, 20]
+    assert [u['update_id'] for u in groups[10]] == [1, 3]
+    assert [u['update_id'] for u in groups[20]] == [2, 5]
+
+def test_next_offset():
+    assert poller.next_offset([], 7) == 7
+    assert poller.next_offset([message_update(10, 1), message_update(12, 1)], 7) == 13
+    assert poller.next_offset([{'foo': 'bar'}], 7) == 7
+
+def test_poll_once_skips_poison_update(fake_telegram, processed):
+    calls, responses = fake_telegram
+    responses['getUpdates'] = {'ok': True, 'result': [
+        message_update(100, 1),
+        {'update_id': 101, 'callback_query': {'id': 'x', 'message': 'broken'}},
+        message_update(102, 1, '/menu'),
+    ]}
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        offset = poller.poll_once(poller.ChatDispatcher(executor), 0)
+    assert offset == 103
+    assert calls[0][0] == 'getUpdates' and calls[0][1]['offset'] == 0
+    # Состояние из пакетной загрузки передаётся только первому update чата
+    assert processed == [(100, {'chat': 1}), (102, index.STATE_NOT_LOADED)]
+
+def test_poll_once_raises_on_api_error(fake_telegram, processed):
+    calls, responses = fake_telegram
+    responses['getUpdates'] = {'ok': False, 'description': 'Conflict'}
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with pytest.raises(RuntimeError, match='Conflict'):
+            poller.poll_once(poller.ChatDispatcher(executor), 5)
+
+def test_delete_webhook_checks_response(fake_telegram):
+    calls, responses = fake_telegram
+    poller.delete_webhook()
+    responses['deleteWebhook'] = {'ok': False, 'description': 'Unauthorized'}
+    with pytest.raises(RuntimeError, match='Unauthorized'):
+        poller.delete_webhook()
+
+def test_busy_chat_does_not_block_others(monkeypatch):
+    release = threading.Event()
+    done = []
+
+    def fake_process(update, state=index.STATE_NOT_LOADED):
+        if update['update_id'] == 1:
+            release.wait(5)
+        done.append(update['update_id'])
+
+    monkeypatch.setattr(index, 'process_update', fake_process)
+    monkeypatch.setattr(index, 'get_user_states', lambda chat_ids: {})
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        dispatcher = poller.ChatDispatcher(executor)
+        poller.dispatch_batch(dispatcher, [message_update(1, 10)])
+        poller.dispatch_batch(dispatcher, [message_update(2, 10), message_update(3, 20)])
+        # Чат 20 обрабатывается, пока чат 10 занят
+        for _ in range(100):
+            if 3 in done:
+                break
+            threading.Event().wait(0.01)
+        assert done == [3]
+        assert dispatcher.is_busy(10)
+        release.set()
+    assert done == [3, 1, 2]
+    assert not dispatcher.queues
+
+def test_busy_chat_is_not_prefetched(monkeypatch):
+    requested = []
+    monkeypatch.setattr(index, 'get_user_states', lambda chat_ids: requested.append(list(chat_ids)) or {})
+    executor = ThreadPoolExecutor(max_workers=1)
+    dispatcher = poller.ChatDispatcher(executor)
+    dispatcher.queues[10] = []
+    poller.dispatch_batch(dispatcher, [message_update(1, 10), message_update(2, 20)])
+    assert requested == [[20]]
+    assert [u['update_id'] for u in dispatcher.queues[10]] == [1]
+    dispatcher.queues[10] = []
+    executor.shutdown(wait=True)
+
+def test_backlog_limits_get_updates(fake_telegram, monkeypatch):
+    calls, responses = fake_telegram
+    release = threading.Event()
+    monkeypatch.setattr(poller, 'POLL_MAX_BACKLOG', 2)
+    monkeypatch.setattr(index, 'process_update', lambda update, state=index.STATE_NOT_LOADED: release.wait(5))
+    monkeypatch.setattr(index, 'get_user_states', lambda chat_ids: {})
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        dispatcher = poller.ChatDispatcher(executor)
+        poller.dispatch_batch(dispatcher, [message_update(1, 10), message_update(2, 20)])
+        polling = threading.Thread(target=poller.poll_once, args=(dispatcher, 3))
+        polling.start()
+        polling.join(0.3)
+        # Пока принятые update не обработаны, новые не запрашиваются и не подтверждаются
+        assert polling.is_alive()
+        assert calls == []
+        release.set()
+        polling.join(5)
+    assert not polling.is_alive()
+    assert [method for method, _ in calls] == ['getUpdates']
+    assert calls[0][1]['offset'] == 3
+    assert 1 <= calls[0][1]['limit'] <= 2
+    assert dispatcher.pending == 0
+
+class FakePool:
+    def __init__(self, conn):
+        self.conn = conn
+        self.returned = []
+
+    def getconn(self):
+        return self.conn
+
+    def putconn(self, conn, close=False):
+        self.returned.append((conn, close))
+
+class FakeConnection:
+    def __init__(self, error):
+        self.error = error
+        self.closed = 0
+        self.rolled_back = False
+
+    def cursor(self):
+        connection = self
+
+        class Cursor:
+            def execute(self, *args):
+                raise connection.error
+
+        return Cursor()
+
+    def rollback(self):
+        self.rolled_back = True
+
+@pytest.mark.parametrize('error, close', [
+    (psycopg2.OperationalError('server closed the connection'), True),
+    (psycopg2.ProgrammingError('syntax error'), False),
+])
+def test_connection_released_on_error(monkeypatch, error, close):
+    conn = FakeConnection(error)
+    pool = FakePool(conn)
+    monkeypatch.setattr(index, 'db_pool', pool)
+    assert index.get_user_state(1) is None
+    index.save_user_state(1, {'preferences': {}})
+    assert pool.returned == [(conn, close), (conn, close)]
+    assert conn.rolled_back is not close
+
+@pytest.mark.parametrize('state', [{'step': 'diet', 'preferences': {}, 'menu': None}, None])
+def test_process_update_uses_prefetched_state(monkeypatch, state):
+    sent = []
+    monkeypatch.setattr(index, 'get_user_state', lambda chat_id: pytest.fail('unexpected DB read'))
+    monkeypatch.setattr(index, 'send_message', lambda chat_id, text, reply_markup=None: sent.append(text))
+    index.process_update(message_update(1, 10, '/menu'), state)
+    assert sent == ["❌ Сначала создайте меню командой /start"]
+
+def test_callback_without_row_starts_onboarding(monkeypatch):
+    saved = []
+    monkeypatch.setattr(index, 'get_user_state', lambda chat_id: pytest.fail('unexpected DB read'))
+    monkeypatch.setattr(index, 'save_user_state', lambda chat_id, state: saved.append(state['step']))
+    monkeypatch.setattr(index, 'send_message', lambda chat_id, text, reply_markup=None: None)
+    monkeypatch.setattr(index.http_session, 'post', lambda *args, **kwargs: None)
+    index.process_update(callback_update(1, 10), None)
+    assert saved == ['diet']
+
+def test_process_update_falls_back_to_db(monkeypatch):
+    read = []
+    monkeypatch.setattr(index, 'get_user_state', lambda chat_id: read.append(chat_id))
+    monkeypatch.setattr(index, 'send_message', lambda chat_id, text, reply_markup=None: None)
+    index.process_update(message_update(1, 10, '/menu'))
+    assert read == [10]